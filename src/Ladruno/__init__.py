@@ -1,6 +1,6 @@
 # Ladruno/__init__.py
 
-from Ladruno.core.model import Model
+from Ladruno.core.model import Model, SubmissionError
 
 __version__ = "2.0.0"
-__all__ = ["Model"]
\ No newline at end of file
+__all__ = ["Model", "SubmissionError"]
\ No newline at end of file
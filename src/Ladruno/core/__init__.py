@@ -1,5 +1,5 @@
 # Ladruno/core/__init__.py
 
-from Ladruno.core.model import Model
+from Ladruno.core.model import Model, SubmissionError
 
-__all__ = ["Model"]
\ No newline at end of file
+__all__ = ["Model", "SubmissionError"]
\ No newline at end of file
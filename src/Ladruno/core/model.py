@@ -1,7 +1,79 @@
 # core/model.py
 
 from pathlib import Path
-from Ladruno.engine.run import Run
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+from Ladruno.engine.run import Run, _part_index, _tasks_for
+
+
+def _find_models(root):
+    # Single scandir pass over the tree: a folder holding main.tcl is a model
+    # (no nested models below it), and every folder under a model only
+    # contributes its highest .part-N.mpco.cdata index to that model
+    partitions = {}
+    stack = [(os.fspath(root), None)]
+    while stack:
+        folder, owner = stack.pop()
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        files.append(entry.name)
+        except OSError:
+            continue
+        
+        if owner is None and "main.tcl" in files:
+            owner = folder
+            partitions[owner] = -1
+        
+        if owner is not None:
+            partitions[owner] = max(
+                (
+                    idx
+                    for name in files
+                    if name.endswith(".mpco.cdata") and (idx := _part_index(name)) is not None
+                ),
+                default=partitions[owner]
+            )
+        
+        stack.extend((sub, owner) for sub in subdirs)
+    
+    return {Path(folder): _tasks_for(max_idx) for folder, max_idx in partitions.items()}
+
+
+class _ThreadStdout:
+    # sys.stdout stand-in for Model.submit: a worker thread that set
+    # local.buffer prints into it, every other thread prints as usual
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    
+    def write(self, text):
+        return getattr(self.local, "buffer", self.stream).write(text)
+    
+    def flush(self):
+        getattr(self.local, "buffer", self.stream).flush()
+
+
+class SubmissionError(RuntimeError):
+    """Raised by Model.submit when a run fails to submit.
+
+    job_ids holds the ids of the runs that did get submitted (in self.runs
+    order), so they can still be waited on or cancelled.
+    """
+    def __init__(self, message, job_ids):
+        super().__init__(message)
+        self.job_ids = job_ids
+
 
 class Model:
     def __init__(self,
@@ -22,20 +94,17 @@ class Model:
         self.archive_destination = archive_destination
         
         self.runs = self._collect_runs()
+        # Jobs handed out by submit() and not yet seen finished by wait()
+        self._jobs: dict[int, Run] = {}
         
         if not self.runs:
             raise FileNotFoundError(f"No main.tcl found in: {self.path}")
     
     def _collect_runs(self):
-        if (self.path / "main.tcl").exists():
-            return [self._create_run(self.path)]
-        
-        runs = []
-        for tcl_path in sorted(self.path.rglob("main.tcl")):
-            runs.append(self._create_run(tcl_path.parent))
-        return runs
+        models = _find_models(self.path)
+        return [self._create_run(folder, models[folder]) for folder in sorted(models)]
     
-    def _create_run(self, folder_path):
+    def _create_run(self, folder_path, preset_tasks=None):
         return Run(
             folder_path=str(folder_path),
             number_of_nodes=self.number_of_nodes,
@@ -43,7 +112,9 @@ class Model:
             max_tasks_per_node=self.max_tasks_per_node,
             verbose=self.verbose,
             opensees_exe=self.opensees_exe,
-            archive_destination=self.archive_destination
+            archive_destination=self.archive_destination,
+            preset_tasks=preset_tasks,
+            _validated=True
         )
     
     def submit(self,
@@ -57,37 +128,151 @@ class Model:
                exclude: list[str] | None = None,
                tcl_file: str = "main.tcl",
                monitor_ram: bool = False,
-               monitor_interval: int = 30,
-               log_file: str = "memtrack_node.txt"):
+               monitor_interval: int = 60,
+               log_file: str = "memtrack_node.txt",
+               wait: bool = False,
+               mpi_flavor: str | None = None):
         
-        job_ids = []
         total = len(self.runs)
+        kwargs = dict(
+            archive=archive,
+            fix=fix,
+            rebuild=rebuild,
+            job_name=job_name,
+            nodes=nodes,
+            ntasks=ntasks,
+            ntasks_per_node=ntasks_per_node,
+            exclude=exclude,
+            tcl_file=tcl_file,
+            monitor_ram=monitor_ram,
+            monitor_interval=monitor_interval,
+            log_file=log_file,
+            wait=wait,
+            mpi_flavor=mpi_flavor
+        )
         
         if self.verbose:
             print(f"\n🚀 Submitting {total} model(s)\n")
         
-        for i, run in enumerate(self.runs, start=1):
-            if self.verbose:
-                print(f"[{i}/{total}] {run.path.name}")
+        # Each run's verbose output (Run.submit and whatever it calls) is
+        # buffered per thread and printed as one block when that run is done,
+        # so concurrent runs never interleave their lines
+        print_lock = threading.Lock()
+        stdout = _ThreadStdout(sys.stdout) if self.verbose else None
+        
+        def _submit(item):
+            i, run = item
+            if stdout is None:
+                return run.submit(**kwargs)
             
-            job_id = run.submit(
-                archive=archive,
-                fix=fix,
-                rebuild=rebuild,
-                job_name=job_name,
-                nodes=nodes,
-                ntasks=ntasks,
-                ntasks_per_node=ntasks_per_node,
-                exclude=exclude,
-                tcl_file=tcl_file,
-                monitor_ram=monitor_ram,
-                monitor_interval=monitor_interval,
-                log_file=log_file
+            stdout.local.buffer = io.StringIO()
+            try:
+                return run.submit(**kwargs)
+            finally:
+                block = stdout.local.buffer.getvalue()
+                del stdout.local.buffer
+                with print_lock:
+                    stdout.stream.write(f"[{i}/{total}] {run.path.name}\n{block}")
+                    stdout.stream.flush()
+        
+        # sbatch and the folder walks are I/O bound, so threads overlap them;
+        # sbatch --wait blocks until its job ends, so then every run needs one
+        workers = total if wait else min(16, total)
+        results = [None] * total
+        failed = None
+        if stdout is not None:
+            sys.stdout = stdout
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futures = {
+                    ex.submit(_submit, (i, run)): i
+                    for i, run in enumerate(self.runs, start=1)
+                }
+                for fut in as_completed(futures):
+                    if fut.cancelled():
+                        continue
+                    try:
+                        results[futures[fut] - 1] = fut.result()
+                    except Exception as e:
+                        # Keep the ids already handed out; don't start new runs.
+                        # Cancel one by one: shutdown(cancel_futures=True) drops
+                        # queued futures without notifying as_completed
+                        if failed is None:
+                            failed = (futures[fut], e)
+                            for other in futures:
+                                other.cancel()
+        finally:
+            if stdout is not None:
+                sys.stdout = stdout.stream
+        
+        job_ids = [job_id for job_id in results if job_id is not None]
+        if not wait:
+            # sbatch --wait runs have already been post-processed
+            self._jobs.update(
+                (job_id, run) for run, job_id in zip(self.runs, results) if job_id is not None
             )
-            job_ids.append(job_id)
+        
+        if failed is not None:
+            i, e = failed
+            raise SubmissionError(
+                f"Submitting {self.runs[i - 1].path.name} failed "
+                f"({len(job_ids)} of {total} job(s) submitted: {job_ids})",
+                job_ids
+            ) from e
         
         if self.verbose:
             print(f"\n✅ {total} job(s) submitted")
             print("LARGA VIDA AL LADRUÑO!!!\n")
         
-        return job_ids
\ No newline at end of file
+        return job_ids
+    
+    def wait(self,
+             job_ids: list[int] | None = None,
+             fix: bool = True,
+             poll_interval: int = 30,
+             max_poll_interval: int = 300,
+             poll_backoff: float = 2.0):
+        # Each id is matched to the Run that submit() got it for, so the
+        # repair always lands on the right folder; None waits on them all
+        if job_ids is None:
+            job_ids = list(self._jobs)
+        unknown = [j for j in job_ids if j not in self._jobs]
+        if unknown:
+            raise ValueError(f"Job id(s) not submitted by this Model or already waited on: {unknown}")
+        pending = {j: self._jobs[j] for j in job_ids}
+        # Exponential backoff: short jobs are noticed quickly, long jobs cost
+        # O(log T) squeue calls. Never poll faster than 5 s (same idea as
+        # AiiDA/Snakemake's minimum job poll interval) to spare slurmctld.
+        interval = max(poll_interval // 6, 5)
+        
+        if self.verbose:
+            print(f"\n⏳ Waiting for {len(pending)} job(s)\n")
+        
+        while pending:
+            running = self._running_jobs(pending)
+            if running is not None:
+                for job_id in [j for j in pending if j not in running]:
+                    del self._jobs[job_id]
+                    pending.pop(job_id)._postprocess(job_id, fix=fix)
+            
+            if pending:
+                time.sleep(interval)
+                interval = min(interval * poll_backoff, max_poll_interval)
+        
+        if self.verbose:
+            print(f"\n✅ {len(job_ids)} job(s) finished")
+            print("LARGA VIDA AL LADRUÑO!!!\n")
+    
+    @staticmethod
+    def _running_jobs(job_ids):
+        # One squeue call for the whole watchlist; None means "unknown, retry"
+        proc = subprocess.run(
+            ["squeue", "-h", "-o", "%i", "-j", ",".join(map(str, job_ids))],
+            capture_output=True,
+            text=True
+        )
+        
+        if proc.returncode != 0 and "Invalid job id" not in proc.stderr:
+            return None
+        
+        return {int(tok) for tok in proc.stdout.split() if tok.isdigit()}
@@ -1,11 +1,177 @@
 # engine/run.py
 
 from pathlib import Path
-import re
+import functools
+import os
 import subprocess
-import textwrap
 from Ladruno.utilities.h5 import H5RepairTool
 
+_job_submit_description = False
+
+
+def _pyslurm_job_desc():
+    """PySlurm's JobSubmitDescription class, or None to fall back to sbatch.
+
+    Imported on first submit so that building run.sh never loads libslurm.
+    None also covers older PySlurm releases that only have the pyslurm.job()
+    API, or whose JobSubmitDescription cannot read #SBATCH lines yet.
+    """
+    global _job_submit_description
+    if _job_submit_description is False:
+        try:
+            import pyslurm
+        except ImportError:
+            pyslurm = None
+        desc = getattr(pyslurm, "JobSubmitDescription", None)
+        if not hasattr(desc, "load_sbatch_options"):
+            desc = None
+        _job_submit_description = desc
+    return _job_submit_description
+
+
+def _iter_cdata(root):
+    # Explicit-stack scandir walk: dirent types come for free, and only the
+    # names are yielded, no Path object per entry as with Path.glob("**/...")
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".mpco.cdata"):
+                        yield entry.name
+        except OSError:
+            continue
+
+
+def _part_index(name):
+    # "<name>.part-<N>.mpco.cdata" -> N; a suffix split is much cheaper than
+    # a regex search per file name
+    _, sep, idx = name[:-len(".mpco.cdata")].rpartition(".part-")
+    return int(idx) if sep and idx.isdecimal() else None
+
+
+def _tasks_for(max_idx):
+    # Distinct indices >= 0 can never outnumber max_idx + 1, so the highest
+    # index alone fixes the task count and no set of indices is needed
+    return max(max_idx + 1, 1)
+
+
+# Shared run.sh body, built once at import; build_run_script only fills in
+# the per-run fields with str.format_map.
+# MPCO writes one .part-N.mpco file per rank through serial HDF5 (no MPI-IO),
+# so HDF5 file locking is pure metadata overhead on NFS/Lustre and is turned
+# off. Nothing else may open those files for writing while the job runs.
+_RUN_BODY = """\
+pwd; hostname; date
+export OMP_NUM_THREADS=1
+export HDF5_USE_FILE_LOCKING=FALSE
+LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/mnt/nfshare/lib
+
+{monitor_block}
+SECONDS=0
+mpirun {mpi_args}{exe} {tcl_file}
+
+[ -n "$MONITOR_PID" ] && kill "$MONITOR_PID" 2>/dev/null
+
+{epilogue}
+"""
+
+_PLAIN_EPILOGUE = """\
+echo "Elapsed: $SECONDS seconds."
+echo "Code finished successfully."
+echo "LARGA VIDA AL LADRUÑO!!!"\
+"""
+
+
+# One ps snapshot filtered by awk per tick, instead of a ps per PID;
+# [o]penseesmp keeps awk from matching its own command line. The log is
+# opened once for the whole loop rather than re-opened on every append.
+_RAM_MONITOR_BLOCK = """\
+( while true; do
+    date '+%F %T'
+    free -h
+    echo "-----------"
+    ps -eo pid,%mem,rss,vsz,args --no-headers | awk '/[o]penseesmp/ {{ print "PID: " $1; print }}'
+    echo "======================"
+    sleep {interval}
+done >> {log_file} & )
+MONITOR_PID=$!
+"""
+
+_MOVE_AND_CLEANUP_BLOCK = """\
+EXIT_CODE=$?
+DURATION=$SECONDS
+
+# Forzar EXIT_CODE=0 si hay SUCCESS en el log
+if grep -q "SUCCESS" log.log 2>/dev/null; then
+    EXIT_CODE=0
+fi
+
+echo "Elapsed: $DURATION seconds."
+echo "Code finished with exit code $EXIT_CODE."
+
+ORIG_PATH=$(pwd)
+REL_PATH="${ORIG_PATH#/mnt/deadmanschest/pxpalacios/}"
+DEST_BASE="/mnt/krakenschest/home/pxpalacios"
+DEST_PATH="${DEST_BASE}/${REL_PATH}"
+
+STATUS_FILE="status.txt"
+{
+    echo "Execution Date: $(date)"
+    echo "Executed By: $(whoami)"
+    echo "Duration: $DURATION seconds"
+    echo "Exit Code: $EXIT_CODE"
+    echo "Original Path: $ORIG_PATH"
+    echo "Destination Path: $DEST_PATH"
+} > "$STATUS_FILE"
+
+if [ "$EXIT_CODE" -eq 0 ]; then
+    echo "📁 Copiando a destino: $DEST_PATH"
+    mkdir -p "$DEST_PATH"
+    if [ "$(stat -c %d .)" = "$(stat -c %d "$DEST_PATH")" ]; then
+        # Mismo filesystem: hard links (cp -al) crean el destino sin copiar bytes
+        # y sin tocar el origen, que solo se borra si la copia salió bien.
+        # Si no se pueden crear los links, rsync hace la copia completa.
+        find . -mindepth 1 -maxdepth 1 ! -name "status.txt" -exec cp -alf -t "$DEST_PATH/" {} +
+        COPY_STATUS=$?
+        if [ "$COPY_STATUS" -ne 0 ]; then
+            rsync -a --inplace --whole-file --exclude="status.txt" ./ "$DEST_PATH/"
+            COPY_STATUS=$?
+        fi
+    elif [ "$(find . -mindepth 1 ! -name "status.txt" | head -n 1001 | wc -l)" -gt 1000 ]; then
+        # Muchos archivos: un stream tar evita el costo de metadata por archivo
+        tar -cf - --exclude="status.txt" . | tar -xf - -C "$DEST_PATH"
+        COPY_STATUS=$(( ${PIPESTATUS[0]} | ${PIPESTATUS[1]} ))
+    else
+        # --inplace: sin archivo temporal + rename por cada archivo
+        rsync -a --inplace --whole-file --exclude="status.txt" ./ "$DEST_PATH/"
+        COPY_STATUS=$?
+    fi
+    if [ "$COPY_STATUS" -eq 0 ]; then
+        echo "✅ Copia completada. Limpiando carpeta original (excepto status.txt)..."
+        find . -mindepth 1 ! -name "status.txt" -exec rm -rf {} +
+        echo "🧼 Limpieza completa."
+    else
+        echo "⚠️ Error en la copia. No se elimina nada."
+    fi
+else
+    echo "❌ Simulación fallida. No se copia ni borra nada."
+fi
+
+echo "LARGA VIDA AL LADRUÑO!!!"
+"""
+
+# Opt-in only (mpi_flavor="openmpi"): the .mpco writers do serial HDF5 per
+# partition, so MPI-IO is normally unused. For builds that do use it, Open
+# MPI >= 3 defaults to OMPIO, which has known HDF5 write regressions on
+# parallel filesystems; excluding it makes Open MPI fall back to ROMIO.
+_MPI_ARGS = {
+    "openmpi": "--mca io ^ompio ",
+}
+
+
 class Run:
     def __init__(self,
                  folder_path: str,
@@ -14,47 +180,64 @@ class Run:
                  max_tasks_per_node: int = 32,
                  verbose: bool = False,
                  opensees_exe: str = "/mnt/nfshare/bin/openseesmp-26062025",
-                 archive_destination: str = "/mnt/krakenschest/home/pxpalacios"):
+                 archive_destination: str = "/mnt/krakenschest/home/pxpalacios",
+                 preset_tasks: int | None = None,
+                 _validated: bool = False):
         
-        self.path = Path(folder_path).resolve()
+        # Model passes _validated=True: the folder comes from its walk of an
+        # already resolved root and holds main.tcl, so skip resolve() and the
+        # existence check (each one stats every path component)
+        self.path = Path(folder_path) if _validated else Path(folder_path).resolve()
         self.number_of_nodes = number_of_nodes
         self.max_nodes = max_nodes
         self.max_tasks_per_node = max_tasks_per_node
         self.verbose = verbose
         self.opensees_exe = Path(opensees_exe)
         self.archive_destination = Path(archive_destination)
+        # Set by submit(): _postprocess then looks for the .mpco files where
+        # the run.sh archive block moved them
+        self._archive = False
+        if preset_tasks is not None:
+            self.__dict__["tasks"] = preset_tasks
         
-        self.fix = H5RepairTool(
+        if not _validated and not os.path.isfile(self.path / "main.tcl"):
+            raise FileNotFoundError(f"main.tcl not found in: {self.path}")
+    
+    @functools.cached_property
+    def fix(self):
+        # Built on first use: H5RepairTool globs the folder when constructed
+        return H5RepairTool(
             directory=self.path,
             pattern="*.mpco",
             verbose=self.verbose
         )
-        
-        if not (self.path / "main.tcl").exists():
-            raise FileNotFoundError(f"main.tcl not found in: {self.path}")
     
     def get_folder_name(self):
         return self.path.name
     
-    def get_tasks(self):
-        part_rx = re.compile(r"\.part-(\d+)\.mpco\.cdata$")
-        indices = {
-            int(m.group(1))
-            for p in self.path.glob("**/*.mpco.cdata")
-            if (m := part_rx.search(p.name))
-        }
-        
-        if not indices:
-            return 1
+    @functools.cached_property
+    def tasks(self):
+        max_idx = -1
+        count = 0
+        for name in _iter_cdata(self.path):
+            idx = _part_index(name)
+            if idx is None:
+                continue
+            count += 1
+            if idx > max_idx:
+                max_idx = idx
         
-        max_idx = max(indices) + 1
-        unique = len(indices)
-        
-        if self.verbose:
+        if count and self.verbose:
             print('----'*60)
-            print(f"Found {unique} partitions, max index {max_idx - 1}")
+            print(f"Found {count} partition files, max index {max_idx}")
         
-        return max(max_idx, unique)
+        return _tasks_for(max_idx)
+    
+    def get_tasks(self):
+        return self.tasks
+    
+    def invalidate_tasks_cache(self):
+        self.__dict__.pop("tasks", None)
     
     def get_nodes_and_tasks(self):
         ntasks_required = max(self.get_tasks(), 1)
@@ -86,8 +269,10 @@ class Run:
                exclude: list[str] | None = None,
                tcl_file: str = "main.tcl",
                monitor_ram: bool = False,
-               monitor_interval: int = 30,
-               log_file: str = "memtrack_node.txt"):
+               monitor_interval: int = 60,
+               log_file: str = "memtrack_node.txt",
+               wait: bool = False,
+               mpi_flavor: str | None = None):
         
         if rebuild:
             self.build_run_script(
@@ -101,86 +286,91 @@ class Run:
                 monitor_ram=monitor_ram,
                 monitor_interval=monitor_interval,
                 log_file=log_file,
-                archive=archive
+                archive=archive,
+                mpi_flavor=mpi_flavor
             )
         
         script = self.path / "run.sh"
+        self._archive = archive
         
+        # In-process submission through libslurm when PySlurm is installed;
+        # sbatch --wait has no PySlurm equivalent, so waiting keeps the CLI
+        if not wait and _pyslurm_job_desc() is not None:
+            job_id = self._submit_pyslurm(script)
+        else:
+            job_id = self._submit_sbatch(script, wait=wait)
+        
+        if self.verbose:
+            print(f"🚀 Job {job_id} submitted")
+        
+        if wait:
+            self._postprocess(job_id, fix=fix)
+        
+        return job_id
+    
+    def _submit_sbatch(self, script: Path, wait: bool = False) -> int:
+        # --wait blocks until the job ends and returns the job's exit code,
+        # so only a missing job id counts as a submission failure
+        cmd = ["sbatch", "--wait", str(script)] if wait else ["sbatch", str(script)]
+        # Bytes mode: only the job id is parsed, so skip decoding the output
         proc = subprocess.run(
-            ["sbatch", str(script)],
+            cmd,
             capture_output=True,
-            text=True,
-            check=True,
+            check=not wait,
             cwd=self.path
         )
         
-        job_id = int(proc.stdout.split()[-1])
+        if b"Submitted batch job" not in proc.stdout:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, proc.stdout, proc.stderr)
         
-        if self.verbose:
-            print(f"🚀 Job {job_id} submitted")
+        return int(proc.stdout.split(b"Submitted batch job", 1)[1].split()[0])
+    
+    def _submit_pyslurm(self, script: Path) -> int:
+        desc = _pyslurm_job_desc()(
+            script=str(script),
+            working_directory=str(self.path)
+        )
+        desc.load_sbatch_options()
+        return int(desc.submit())
+    
+    def _postprocess(self, job_id: int, fix: bool = True):
+        if fix:
+            folders = [self.path]
+            if self._archive:
+                # A successful archived job leaves only status.txt here; the
+                # .mpco files are in the destination it recorded
+                dest = self._archive_path()
+                if dest is not None and dest.is_dir():
+                    folders.append(dest)
+                else:
+                    print(f"⚠️ Archive of {self.get_folder_name()} not found; its HDF5 files were not checked")
+            
+            for folder in folders:
+                H5RepairTool(
+                    directory=folder,
+                    pattern="*.mpco",
+                    verbose=self.verbose
+                ).run_full_check_and_fix(workers=os.cpu_count())
         
-        return job_id
+        if self.verbose:
+            print(f"🏁 Job {job_id} finished ({self.get_folder_name()})")
+    
+    def _archive_path(self) -> Path | None:
+        # Written by the archive block of run.sh once the job has ended
+        try:
+            with open(self.path / "status.txt") as fh:
+                for line in fh:
+                    if line.startswith("Destination Path: "):
+                        return Path(line.split(": ", 1)[1].strip())
+        except OSError:
+            pass
+        return None
+    
+    def _ram_monitor_block(self, interval: int = 60, log_file: str = "memtrack_node.txt"):
+        return _RAM_MONITOR_BLOCK.format(interval=interval, log_file=log_file)
     
-    def _ram_monitor_block(self, interval: int = 30, log_file: str = "memtrack_node.txt"):
-        return textwrap.dedent(f"""\
-            ( while true; do
-                printf '%s\\n' "$(date '+%F %T')" >> {log_file}
-                free -h >> {log_file}
-                echo "-----------" >> {log_file}
-                pgrep -af openseesmp | while read PID CMD; do
-                    echo "PID: $PID" >> {log_file}
-                    ps -p "$PID" -o pid,%mem,rss,vsz,cmd --no-headers >> {log_file}
-                done
-                echo "======================" >> {log_file}
-                sleep {interval}
-            done & )
-            MONITOR_PID=$!
-        """)
     def _move_and_cleanup_block(self):
-        return textwrap.dedent("""\
-            EXIT_CODE=$?
-            DURATION=$SECONDS
-            
-            # Forzar EXIT_CODE=0 si hay SUCCESS en el log
-            if grep -q "SUCCESS" log.log 2>/dev/null; then
-                EXIT_CODE=0
-            fi
-            
-            echo "Elapsed: $DURATION seconds."
-            echo "Code finished with exit code $EXIT_CODE."
-            
-            ORIG_PATH=$(pwd)
-            REL_PATH="${ORIG_PATH#/mnt/deadmanschest/pxpalacios/}"
-            DEST_BASE="/mnt/krakenschest/home/pxpalacios"
-            DEST_PATH="${DEST_BASE}/${REL_PATH}"
-            
-            STATUS_FILE="status.txt"
-            {
-                echo "Execution Date: $(date)"
-                echo "Executed By: $(whoami)"
-                echo "Duration: $DURATION seconds"
-                echo "Exit Code: $EXIT_CODE"
-                echo "Original Path: $ORIG_PATH"
-                echo "Destination Path: $DEST_PATH"
-            } > "$STATUS_FILE"
-            
-            if [ "$EXIT_CODE" -eq 0 ]; then
-                echo "📁 Copiando a destino: $DEST_PATH"
-                mkdir -p "$DEST_PATH"
-                rsync -a --exclude="status.txt" ./ "$DEST_PATH/"
-                if [ $? -eq 0 ]; then
-                    echo "✅ Copia completada. Limpiando carpeta original (excepto status.txt)..."
-                    find . -mindepth 1 ! -name "status.txt" -exec rm -rf {} +
-                    echo "🧼 Limpieza completa."
-                else
-                    echo "⚠️ Error en la copia. No se elimina nada."
-                fi
-            else
-                echo "❌ Simulación fallida. No se copia ni borra nada."
-            fi
-            
-            echo "LARGA VIDA AL LADRUÑO!!!"
-        """)
+        return _MOVE_AND_CLEANUP_BLOCK
     
     def build_run_script(self,
                         job_name: str | None = None,
@@ -191,10 +381,16 @@ class Run:
                         exe: str | Path = None,
                         tcl_file: str = "main.tcl",
                         monitor_ram: bool = False,
-                        monitor_interval: int = 30,
+                        monitor_interval: int = 60,
                         log_file: str = "memtrack_node.txt",
                         archive: bool = False,
-                        script_name: str = "run.sh"):
+                        script_name: str = "run.sh",
+                        mpi_flavor: str | None = None):
+        
+        if mpi_flavor is not None:
+            mpi_flavor = mpi_flavor.lower()
+            if mpi_flavor not in _MPI_ARGS:
+                raise ValueError(f"Unknown mpi_flavor {mpi_flavor!r}; expected None or one of {sorted(_MPI_ARGS)}")
         
         if nodes is None or ntasks is None:
             nodes, ntasks = self.get_nodes_and_tasks()
@@ -226,40 +422,21 @@ class Run:
         
         monitor_block = self._ram_monitor_block(interval=monitor_interval, log_file=log_file) if monitor_ram else ""
         
-        if archive:
-            body = textwrap.dedent(f"""\
-pwd; hostname; date
-export OMP_NUM_THREADS=1
-LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/mnt/nfshare/lib
-
-{monitor_block}
-SECONDS=0
-mpirun {exe} {tcl_file}
-
-[ -n "$MONITOR_PID" ] && kill "$MONITOR_PID" 2>/dev/null
-
-{self._move_and_cleanup_block()}
-""")
-        else:
-            body = textwrap.dedent(f"""\
-pwd; hostname; date
-export OMP_NUM_THREADS=1
-LD_LIBRARY_PATH=$LD_LIBRARY_PATH:/mnt/nfshare/lib
-
-{monitor_block}
-SECONDS=0
-mpirun {exe} {tcl_file}
-
-[ -n "$MONITOR_PID" ] && kill "$MONITOR_PID" 2>/dev/null
-
-echo "Elapsed: $SECONDS seconds."
-echo "Code finished successfully."
-echo "LARGA VIDA AL LADRUÑO!!!"
-""")
+        body = _RUN_BODY.format_map({
+            "monitor_block": monitor_block,
+            "mpi_args": _MPI_ARGS[mpi_flavor] if mpi_flavor else "",
+            "exe": exe,
+            "tcl_file": tcl_file,
+            "epilogue": self._move_and_cleanup_block() if archive else _PLAIN_EPILOGUE,
+        })
         
+        # One open/write/close with the mode set on the open fd, instead of
+        # write_text plus a path-based chmod (an extra lookup on NFS/Lustre)
         script_path = self.path / script_name
-        script_path.write_text("\n".join(header) + "\n" + body)
-        script_path.chmod(0o755)
+        fd = os.open(script_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o755)
+        with os.fdopen(fd, "wb") as fh:
+            os.fchmod(fd, 0o755)
+            fh.write(("\n".join(header) + "\n" + body).encode())
         
         if self.verbose:
             print(f"📝 run.sh created (nodes={nodes}, ntasks={ntasks})")
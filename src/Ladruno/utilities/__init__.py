@@ -1,5 +1,5 @@
 # Ladruno/utilities/__init__.py
 
-from Ladruno.utilities.h5 import H5RepairTool
+from Ladruno.utilities.h5 import H5RepairTool, Stat
 
-__all__ = ["H5RepairTool"]
\ No newline at end of file
+__all__ = ["H5RepairTool", "Stat"]
\ No newline at end of file
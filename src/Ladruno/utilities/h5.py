@@ -1,9 +1,233 @@
 from __future__ import annotations
 from pathlib import Path
 from typing import Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+import fnmatch
+import os
 import subprocess
-from datetime import datetime
-from pathlib import Path
+
+
+_HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+
+# Superblock v3 "file consistency flags" (byte 11): write access and SWMR
+# write access. These are what "file is already open for write" refers to,
+# and the library only checks them on v3 superblocks.
+_WRITE_ACCESS_FLAGS = 0x01 | 0x04
+# h5clear -i default: EOA becomes max(EOA, EOF) + 1 MiB
+_EOA_INCREMENT = 1024 * 1024
+# Thread count for scan / fix_flagged / run_full_check_and_fix when
+# workers is not given
+_DEFAULT_WORKERS = 16
+
+
+class Stat(IntEnum):
+    """Per-file status kept in H5RepairTool.status."""
+    OK = 0
+    FLAGGED = 1
+    ERROR = 2
+
+
+_h5py = None
+
+
+def _h5():
+    """Import h5py on first use; it pulls in numpy and libhdf5, which only
+    the fallback probe needs (building or submitting run.sh never does)."""
+    global _h5py
+    if _h5py is None:
+        import h5py as _h5py
+    return _h5py
+
+
+# ----------------------------------------------------------------------
+# per-file workers
+# ----------------------------------------------------------------------
+def _superblock_flags(f: str) -> Optional[int]:
+    """Return the v3 superblock consistency flags, or None if not applicable.
+
+    Reads the superblock with pread instead of going through h5py. The
+    answer is only trusted when the checksum matches and the file size is
+    consistent with the stored end-of-file address: equal for a clean file,
+    at least as large for a flagged one (a killed writer leaves the stored
+    value behind). Anything else, e.g. a truncated file, returns None so the
+    caller falls back to a real h5py open. Files with a user block
+    (signature not at offset 0) or an older superblock also return None.
+    """
+    try:
+        fd = os.open(f, os.O_RDONLY)
+        try:
+            sb = _read_superblock(fd)
+            file_size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+
+    if sb is None or sb[8] != 3:
+        return None
+
+    flags = sb[11]
+    end = _superblock_base(sb) + _superblock_eof(sb)
+    if flags & _WRITE_ACCESS_FLAGS:
+        return flags if file_size >= end else None
+    return flags if file_size == end else None
+
+
+def _probe_one(f: str) -> tuple[str, Stat, Optional[str]]:
+    """Return (f, status, error message or None) for a single file."""
+    flags = _superblock_flags(f)
+    if flags is not None:
+        return f, Stat.FLAGGED if flags & _WRITE_ACCESS_FLAGS else Stat.OK, None
+
+    try:
+        with _h5().File(f, "r"):
+            return f, Stat.OK, None
+    except OSError as e:
+        msg = str(e)
+        if "file is already open for write" in msg:
+            return f, Stat.FLAGGED, None
+        return f, Stat.ERROR, msg
+
+
+def _lookup3(data: bytes) -> int:
+    """Bob Jenkins' lookup3 hashlittle (initval 0): HDF5's metadata checksum."""
+    M = 0xFFFFFFFF
+
+    def rot(x, k):
+        return ((x << k) | (x >> (32 - k))) & M
+
+    def mix(a, b, c):
+        a = (a - c) & M
+        a ^= rot(c, 4)
+        c = (c + b) & M
+        b = (b - a) & M
+        b ^= rot(a, 6)
+        a = (a + c) & M
+        c = (c - b) & M
+        c ^= rot(b, 8)
+        b = (b + a) & M
+        a = (a - c) & M
+        a ^= rot(c, 16)
+        c = (c + b) & M
+        b = (b - a) & M
+        b ^= rot(a, 19)
+        a = (a + c) & M
+        c = (c - b) & M
+        c ^= rot(b, 4)
+        b = (b + a) & M
+        return a, b, c
+
+    def final(a, b, c):
+        c ^= b
+        c = (c - rot(b, 14)) & M
+        a ^= c
+        a = (a - rot(c, 11)) & M
+        b ^= a
+        b = (b - rot(a, 25)) & M
+        c ^= b
+        c = (c - rot(b, 16)) & M
+        a ^= c
+        a = (a - rot(c, 4)) & M
+        b ^= a
+        b = (b - rot(a, 14)) & M
+        c ^= b
+        c = (c - rot(b, 24)) & M
+        return c
+
+    n = len(data)
+    a = b = c = (0xDEADBEEF + n) & M
+    i = 0
+    while n - i > 12:
+        a = (a + int.from_bytes(data[i:i + 4], "little")) & M
+        b = (b + int.from_bytes(data[i + 4:i + 8], "little")) & M
+        c = (c + int.from_bytes(data[i + 8:i + 12], "little")) & M
+        a, b, c = mix(a, b, c)
+        i += 12
+
+    if n == i:
+        return c
+
+    tail = data[i:].ljust(12, b"\0")
+    a = (a + int.from_bytes(tail[0:4], "little")) & M
+    b = (b + int.from_bytes(tail[4:8], "little")) & M
+    c = (c + int.from_bytes(tail[8:12], "little")) & M
+    return final(a, b, c)
+
+
+def _read_superblock(fd: int) -> Optional[bytes]:
+    """Read a v2/v3 superblock at offset 0, without its checksum.
+
+    Layout: signature(8) version(1) sizeof_addr(1) sizeof_size(1) flags(1)
+    then base, extension, end-of-file and root addresses (sizeof_addr bytes
+    each) and a lookup3 checksum of everything before it. Returns None
+    unless the signature, version and checksum all check out.
+    """
+    head = os.pread(fd, 12, 0)
+    if len(head) < 12 or not head.startswith(_HDF5_SIGNATURE) or head[8] not in (2, 3):
+        return None
+
+    size = 12 + 4 * head[9]
+    block = os.pread(fd, size + 4, 0)
+    if len(block) < size + 4 or _lookup3(block[:size]) != int.from_bytes(block[size:], "little"):
+        return None
+    return block[:size]
+
+
+def _superblock_base(sb: bytes) -> int:
+    return int.from_bytes(sb[12:12 + sb[9]], "little")
+
+
+def _superblock_eof(sb: bytes) -> int:
+    o = sb[9]
+    return int.from_bytes(sb[12 + 2 * o:12 + 3 * o], "little")
+
+
+def _clear_in_place(f: str) -> bool:
+    """Do what h5clear -s -i does to a v2/v3 superblock, with pread/pwrite.
+
+    -s zeroes the status flags; -i raises the end-of-file address to
+    max(stored, actual) + 1 MiB and extends the file to match, so a writer
+    killed before its final flush leaves no objects past the EOA. The
+    stored checksum is verified first (see _read_superblock), so nothing is
+    written unless the superblock parsed exactly; returns False when the
+    file is not handled.
+    """
+    try:
+        fd = os.open(f, os.O_RDWR)
+    except OSError:
+        return False
+
+    try:
+        sb = _read_superblock(fd)
+        if sb is None:
+            return False
+
+        o = sb[9]
+        base = _superblock_base(sb)
+        eoa = max(_superblock_eof(sb), os.fstat(fd).st_size - base) + _EOA_INCREMENT
+        cleared = sb[:11] + b"\0" + sb[12:12 + 2 * o] + eoa.to_bytes(o, "little") + sb[12 + 3 * o:]
+
+        os.ftruncate(fd, base + eoa)
+        os.pwrite(fd, cleared[11:] + _lookup3(cleared).to_bytes(4, "little"), 11)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def _clear(f: str) -> tuple[int, bytes]:
+    """Clear the status flags of a single file.
+
+    In-process for v2/v3 superblocks (same result as h5clear -s -i);
+    anything else goes through h5clear (one file per call).
+    """
+    if _clear_in_place(f):
+        return 0, b""
+    result = subprocess.run(["h5clear", "-s", "-i", f], capture_output=True)
+    return result.returncode, result.stderr
 
 
 class H5RepairTool:
@@ -16,8 +240,11 @@ class H5RepairTool:
         
         self.directory: Path = Path(directory)
         self.pattern: str = pattern
-        self.files: list[Path] = sorted(self.directory.glob(pattern))
-        self.status: dict[Path, str] = {}
+        # Plain path strings: lighter than Path objects, and h5py/os take
+        # them as-is; reports use os.path.basename for display
+        self.files: list[str] = self._list_files(self.directory, pattern)
+        self.status: dict[str, Stat] = {}
+        self.errors: dict[str, str] = {}
         self.verbose: bool = verbose          # ← store it!
 
     # ------------------------------------------------------------------
@@ -27,68 +254,107 @@ class H5RepairTool:
         """Return override if given, else fall back to self.verbose."""
         return self.verbose if override is None else override
 
+    def _describe(self, f: str) -> str:
+        """Status label for reports: the Stat name, plus the error message."""
+        stat = self.status[f]
+        if stat is Stat.ERROR:
+            return f"ERROR: {self.errors.get(f, '')}"
+        return stat.name
+
+    @staticmethod
+    def _list_files(directory: Path, pattern: str) -> list[str]:
+        """Sorted paths (as str) of the files in directory matching pattern.
+
+        Uses os.scandir + fnmatch on the raw names, so nothing is built for
+        non-matches. Patterns reaching into subfolders go through glob.
+        """
+        if "/" in pattern:
+            return sorted(str(p) for p in directory.glob(pattern))
+        try:
+            with os.scandir(directory) as it:
+                names = [
+                    e.name for e in it
+                    if fnmatch.fnmatchcase(e.name, pattern) and e.is_file()
+                ]
+        except OSError:
+            return []
+        return sorted(os.path.join(directory, n) for n in names)
+
+    @staticmethod
+    def _map(fn, files: list[str], workers: Optional[int]):
+        """Map fn over files on up to ``workers`` threads (16 by default).
+
+        Both the superblock probe (a plain pread) and h5clear (a child
+        process) release the GIL, so threads overlap the filesystem
+        round-trips; the rare h5py fallback serializes behind h5py's global
+        lock, which is still correct. ``workers=1`` runs serially.
+        """
+        workers = min(workers or _DEFAULT_WORKERS, len(files))
+        if workers <= 1:
+            return list(map(fn, files))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return list(ex.map(fn, files))
+
     # ------------------------------------------------------------------
     # public API
     # ------------------------------------------------------------------
-    def scan(self, verbose: Optional[bool] = None) -> None:
+    def scan(self, verbose: Optional[bool] = None, workers: Optional[int] = None) -> None:
         """Scan all files and store their status internally."""
         verbose = self._is_verbose(verbose)
-        self.status.clear()
-
-        for f in self.files:
-            try:
-                with h5py.File(f, "r"):
-                    self.status[f] = "OK"
-            except OSError as e:
-                msg = str(e)
-                if "file is already open for write" in msg:
-                    self.status[f] = "FLAGGED"
-                else:
-                    self.status[f] = f"ERROR: {msg}"
+        probes = self._map(_probe_one, self.files, workers)
 
-            if verbose:
-                print(f"{f.name:<30} → {self.status[f]}")
+        # Built in one go from the finished results instead of clear() plus
+        # one insert (and the occasional resize) per file
+        self.status = {f: stat for f, stat, _ in probes}
+        self.errors = {f: msg for f, _, msg in probes if msg is not None}
+
+        if verbose:
+            for f in self.status:
+                print(f"{os.path.basename(f):<30} → {self._describe(f)}")
 
     def print_report(self, verbose: Optional[bool] = None) -> None:
         if not self._is_verbose(verbose):
             return
 
         print("File Status Report:")
-        for f, stat in self.status.items():
-            print(f"{f.name:<30} →  {stat}")
+        for f in self.status:
+            print(f"{os.path.basename(f):<30} →  {self._describe(f)}")
 
-        counts = {"OK": 0, "FLAGGED": 0, "ERROR": 0}
-        for s in self.status.values():
-            counts["OK" if s == "OK" else "FLAGGED" if s == "FLAGGED" else "ERROR"] += 1
+        counts = Counter(self.status.values())
 
         print("\nSummary:")
-        for k, v in counts.items():
-            print(f"{k:<8}: {v}")
+        for k in Stat:
+            print(f"{k.name:<8}: {counts[k]}")
 
-    def fix_flagged(self, verbose: Optional[bool] = None) -> None:
+    def fix_flagged(self, verbose: Optional[bool] = None, workers: Optional[int] = None) -> None:
         verbose = self._is_verbose(verbose)
 
-        for f, stat in self.status.items():
-            if stat != "FLAGGED":
-                continue
+        flagged = [f for f, stat in self.status.items() if stat is Stat.FLAGGED]
+        if not flagged:
+            return
+
+        # h5clear takes a single file, so run the calls concurrently instead
+        results = self._map(_clear, flagged, workers)
 
+        for f, (returncode, stderr) in zip(flagged, results):
             if verbose:
-                print(f"Fixing: {f.name}")
+                print(f"Fixing: {os.path.basename(f)}")
 
-            result = subprocess.run(["h5clear", "-s", "-i", str(f)], capture_output=True)
-            if result.returncode == 0:
+            if returncode == 0:
                 if verbose:
-                    print(f"  → Cleared flag on {f.name}")
-                self.status[f] = "OK"
+                    print(f"  → Cleared flag on {os.path.basename(f)}")
+                self.status[f] = Stat.OK
             else:
                 if verbose:
-                    print(f"  ✗ Failed to clear {f.name}")
-                    print(result.stderr.decode())
+                    print(f"  ✗ Failed to clear {os.path.basename(f)}")
+                    print(stderr.decode())
+
+    def run_full_check_and_fix(self, verbose: Optional[bool] = None, workers: Optional[int] = None) -> None:
+        """Scan, print report, and attempt to fix any flagged files.
 
-    def run_full_check_and_fix(self, verbose: Optional[bool] = None) -> None:
-        """Scan, print report, and attempt to fix any flagged files."""
+        ``workers`` is passed to both scan and fix_flagged.
+        """
         verbose = self._is_verbose(verbose)
-        self.scan(verbose)
+        self.scan(verbose, workers)
         self.print_report(verbose)
-        self.fix_flagged(verbose)
-        
\ No newline at end of file
+        self.fix_flagged(verbose, workers)